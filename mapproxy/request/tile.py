@@ -65,7 +65,7 @@ class TileRequest(object):
         if match.group('layer_spec') is not None:
             self.dimensions['_layer_spec'] = match.group('layer_spec')
         if not self.tile:
-            self.tile = tuple([int(match.group(v)) for v in ['x', 'y', 'z']])
+            self.tile = tuple(map(int, match.group('x', 'y', 'z')))
         if not self.format:
             self.format = match.group('format')
 
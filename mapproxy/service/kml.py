@@ -14,12 +14,14 @@
 # limitations under the License.
 
 import re
+import threading
 
 from mapproxy.response import Response
 from mapproxy.exception import RequestError, PlainExceptionHandler
 from mapproxy.service.base import Server
 from mapproxy.request.tile import TileRequest
-from mapproxy.srs import SRS
+from mapproxy.srs import SRS, WEBMERCATOR_EPSG, generate_envelope_points, calculate_bbox
+from mapproxy.util.collections import LRU
 from mapproxy.util.coverage import load_limited_to
 
 
@@ -29,12 +31,8 @@ class KMLRequest(TileRequest):
     """
     request_handler_name = 'map'
     req_prefix = '/kml'
-    tile_req_re = re.compile(r'''^(?P<begin>/kml)/
-            (?P<layer>[^/]+)/
-            ((?P<layer_spec>[^/]+)/)?
-            (?P<z>-?\d+)/
-            (?P<x>-?\d+)/
-            (?P<y>-?\d+)\.(?P<format>\w+)''', re.VERBOSE)
+    tile_req_re = re.compile(r'^(?P<begin>/kml)/(?P<layer>[^/]+)/(?:(?P<layer_spec>[^/]+)/)?'
+                             r'(?P<z>-?\d+)/(?P<x>-?\d+)/(?P<y>-?\d+)\.(?P<format>\w+)')
 
     def __init__(self, request):
         TileRequest.__init__(self, request)
@@ -84,6 +82,8 @@ class KMLServer(Server):
     names = ('kml',)
     request_parser = staticmethod(kml_request)
     request_methods = ('map', 'kml')
+    subtiles_cache_size = 512
+    kml_cache_size = 512
 
     def __init__(self, layers, md, max_tile_age=None, use_dimension_layers=False):
         Server.__init__(self)
@@ -91,6 +91,14 @@ class KMLServer(Server):
         self.md = md
         self.max_tile_age = max_tile_age
         self.use_dimension_layers = use_dimension_layers
+        if not use_dimension_layers:
+            self._layer_aliases = self._build_layer_aliases(layers)
+        self._subtiles_cache = LRU(self.subtiles_cache_size)
+        self._subtiles_cache_lock = threading.Lock()
+        self._kml_cache = LRU(self.kml_cache_size)
+        self._kml_cache_lock = threading.Lock()
+        # KMLRenderer is stateless, reuse one instance for all requests
+        self.renderer = KMLRenderer()
 
     def map(self, map_request):
         """
@@ -133,18 +141,28 @@ class KMLServer(Server):
                         return None
             raise RequestError('forbidden', status=403)
 
+    @staticmethod
+    def _build_layer_aliases(layers):
+        """
+        Map each layer name, and each name without an ``_EPSG4326`` or
+        ``_EPSG900913`` suffix, to its layer. Exact names take precedence
+        over ``_EPSG4326`` layers, which take precedence over ``_EPSG900913``
+        layers.
+        """
+        aliases = {}
+        for suffix in ('_EPSG900913', '_EPSG4326'):
+            for name, layer in layers.items():
+                if name.endswith(suffix):
+                    aliases[name[:-len(suffix)]] = layer
+        aliases.update(layers)
+        return aliases
+
     def _internal_layer(self, tile_request):
         if '_layer_spec' in tile_request.dimensions:
             name = tile_request.layer + '_' + tile_request.dimensions['_layer_spec']
         else:
             name = tile_request.layer
-        if name in self.layers:
-            return self.layers[name]
-        if name + '_EPSG4326' in self.layers:
-            return self.layers[name + '_EPSG4326']
-        if name + '_EPSG900913' in self.layers:
-            return self.layers[name + '_EPSG900913']
-        return None
+        return self._layer_aliases.get(name)
 
     def _internal_dimension_layer(self, tile_request):
         key = (tile_request.layer, tile_request.dimensions.get('_layer_spec'))
@@ -168,72 +186,119 @@ class KMLServer(Server):
         layer = self.layer(map_request)
         self.authorize_tile_layer(layer, map_request)
 
+        url = map_request.http.script_url.rstrip('/')
+        # the KML document only depends on these values, cache the result
+        cache_key = (layer, map_request.layer, map_request.tile, url)
+        with self._kml_cache_lock:
+            result = self._kml_cache.get(cache_key)
+        if result is None:
+            result = self._render_kml(map_request, layer, url)
+            with self._kml_cache_lock:
+                self._kml_cache[cache_key] = result
+
+        resp = Response(result, content_type='application/vnd.google-earth.kml+xml')
+        resp.cache_headers(etag_data=(result,), max_age=self.max_tile_age)
+        resp.make_conditional(map_request.http)
+        return resp
+
+    def _render_kml(self, map_request, layer, url):
         tile_coord = map_request.tile
 
         initial_level = False
         if tile_coord[2] == 0:
             initial_level = True
 
-        bbox = self._tile_wgs_bbox(map_request, layer, limit=True)
-        if bbox is None:
+        src_bbox = layer.tile_bbox(map_request, use_profiles=map_request.use_profiles, limit=True)
+        if src_bbox is None:
             raise RequestError('The requested tile is outside the bounding box '
                                'of the tile map.', request=map_request)
-        tile = SubTile(tile_coord, bbox)
+        tile = SubTile(tile_coord, self._tile_bbox_to_wgs(src_bbox, layer.grid))
 
-        subtiles = self._get_subtiles(map_request, layer)
+        subtiles = self._get_subtiles(map_request, layer, src_bbox)
         tile_size = layer.grid.tile_size[0]
-        url = map_request.http.script_url.rstrip('/')
-        result = KMLRenderer().render(
+        return self.renderer.render(
             tile=tile, subtiles=subtiles, layer=layer, url=url, name=map_request.layer, format=layer.format,
             name_path=layer.md['name_path'], initial_level=initial_level, tile_size=tile_size)
-        resp = Response(result, content_type='application/vnd.google-earth.kml+xml')
-        resp.cache_headers(etag_data=(result,), max_age=self.max_tile_age)
-        resp.make_conditional(map_request.http)
-        return resp
 
-    def _get_subtiles(self, tile_request, layer):
+    def _get_subtiles(self, tile_request, layer, bbox):
         """
         Create four `SubTile` for the next level of `tile`.
+
+        :param bbox: the (limited) bbox of `tile` in the grid SRS
         """
         tile = tile_request.tile
-        bbox = layer.tile_bbox(tile_request, use_profiles=tile_request.use_profiles, limit=True)
 
         level = layer.grid.internal_tile_coord((tile[0], tile[1], tile[2]+1), use_profiles=False)[2]
-        bbox_, tile_grid_, tiles = layer.grid.get_affected_level_tiles(bbox, level)
-        subtiles = []
+
+        # subtiles only depend on the grid, bbox and level, cache them as
+        # clients request the same KML docs over and over
+        cache_key = (layer.grid, bbox, level)
+        with self._subtiles_cache_lock:
+            subtiles = self._subtiles_cache.get(cache_key)
+        if subtiles is None:
+            subtiles = self._create_subtiles(layer, bbox, level)
+            with self._subtiles_cache_lock:
+                self._subtiles_cache[cache_key] = subtiles
+        return subtiles
+
+    def _create_subtiles(self, layer, bbox, level):
+        grid = layer.grid
+        flip = grid.origin not in ('ll', 'sw', None)
+        # only add subtiles where the lower left corner is in the bbox
+        # to prevent subtiles to appear in multiple KML docs
+        DELTA = -1.0/10e6
+        min_x = bbox[0] + DELTA
+        min_y = bbox[1] + DELTA
+
+        bbox_, tile_grid_, tiles = grid.get_affected_level_tiles(bbox, level)
+        coords = []
+        sub_bboxes = []
         for coord in tiles:
             if coord is None:
                 continue
-            sub_bbox = layer.grid.tile_bbox(coord)
-            if sub_bbox is not None:
-                # only add subtiles where the lower left corner is in the bbox
-                # to prevent subtiles to appear in multiple KML docs
-                DELTA = -1.0/10e6
-                if (sub_bbox[0] - bbox[0]) > DELTA and (sub_bbox[1] - bbox[1]) > DELTA:
-                    sub_bbox_wgs = self._tile_bbox_to_wgs(sub_bbox, layer.grid)
-                    coord = layer.grid.external_tile_coord(coord, use_profiles=False)
-                    if layer.grid.origin not in ('ll', 'sw', None):
-                        coord = layer.grid.flip_tile_coord(coord)
-                    subtiles.append(SubTile(coord, sub_bbox_wgs))
-
-        return subtiles
+            sub_bbox = grid.tile_bbox(coord)
+            if sub_bbox is None or sub_bbox[0] <= min_x or sub_bbox[1] <= min_y:
+                continue
+            coord = grid.external_tile_coord(coord, use_profiles=False)
+            if flip:
+                coord = grid.flip_tile_coord(coord)
+            coords.append(coord)
+            sub_bboxes.append(sub_bbox)
 
-    def _tile_wgs_bbox(self, tile_request, layer, limit=False):
-        bbox = layer.tile_bbox(tile_request, use_profiles=tile_request.use_profiles,
-                               limit=limit)
-        if bbox is None:
-            return None
-        return self._tile_bbox_to_wgs(bbox, layer.grid)
+        sub_bboxes_wgs = self._tile_bboxes_to_wgs(sub_bboxes, grid)
+        return tuple(SubTile(coord, sub_bbox_wgs)
+                     for coord, sub_bbox_wgs in zip(coords, sub_bboxes_wgs))
 
     def _tile_bbox_to_wgs(self, src_bbox, grid):
-        bbox = grid.srs.transform_bbox_to(SRS(4326), src_bbox, with_points=4)
-        if grid.srs == SRS(900913):
-            bbox = list(bbox)
-            if abs(src_bbox[1] - -20037508.342789244) < 0.1:
-                bbox[1] = -90.0
-            if abs(src_bbox[3] - 20037508.342789244) < 0.1:
-                bbox[3] = 90.0
-        return bbox
+        return self._tile_bboxes_to_wgs([src_bbox], grid)[0]
+
+    def _tile_bboxes_to_wgs(self, src_bboxes, grid):
+        """
+        Transform all `src_bboxes` from the `grid` SRS to EPSG:4326.
+        Uses the four corners of each bbox and a single transformation
+        call for all bboxes.
+        """
+        if not src_bboxes:
+            return []
+        dst_srs = SRS(4326)
+        if grid.srs == dst_srs:
+            bboxes = list(src_bboxes)
+        else:
+            points = []
+            for src_bbox in src_bboxes:
+                points.extend(generate_envelope_points(src_bbox, 4))
+            points = list(grid.srs.transform_to(dst_srs, points))
+            bboxes = [calculate_bbox(points[i:i+4]) for i in range(0, len(points), 4)]
+
+        if grid.srs.srs_code in WEBMERCATOR_EPSG:
+            for i, src_bbox in enumerate(src_bboxes):
+                minx, miny, maxx, maxy = bboxes[i]
+                if abs(src_bbox[1] - -20037508.342789244) < 0.1:
+                    miny = -90.0
+                if abs(src_bbox[3] - 20037508.342789244) < 0.1:
+                    maxy = 90.0
+                bboxes[i] = (minx, miny, maxx, maxy)
+        return bboxes
 
     def check_map_request(self, map_request):
         if map_request.layer not in self.layers:
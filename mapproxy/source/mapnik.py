@@ -58,6 +58,24 @@ if mapnik and not hasattr(mapnik, 'Box2d'):
 
 log = logging.getLogger(__package__)
 
+# mapnik images are reused for consecutive renderings of the same size
+# within a thread
+_image_local = threading.local()
+
+
+def _render_image(width, height):
+    """
+    Return a cleared `mapnik.Image` with the given size. The image is
+    only valid until the next call from the same thread.
+    """
+    img = getattr(_image_local, 'image', None)
+    if img is not None and img.width() == width and img.height() == height:
+        img.clear()
+    else:
+        img = mapnik.Image(width, height)
+        _image_local.image = img
+    return img
+
 
 class MapnikSource(MapLayer):
     supports_meta_tiles = True
@@ -74,6 +92,10 @@ class MapnikSource(MapLayer):
         self.lock = lock
         self.multithreaded = multithreaded
         self._cache_map_obj = reuse_map_objects
+        if '%(webmercator_level)' in mapfile:
+            self._webmercator_grid = tile_grid(3857)
+        else:
+            self._webmercator_grid = None
         if self.coverage:
             self.extent = MapExtent(self.coverage.bbox, self.coverage.srs)
         else:
@@ -128,8 +150,8 @@ class MapnikSource(MapLayer):
 
     def render(self, query):
         mapfile = self.mapfile
-        if '%(webmercator_level)' in mapfile:
-            _bbox, level = tile_grid(3857).get_affected_bbox_and_level(
+        if self._webmercator_grid is not None:
+            _bbox, level = self._webmercator_grid.get_affected_bbox_and_level(
                 query.bbox, query.size, req_srs=query.srs)
             mapfile = mapfile % {'webmercator_level': level}
 
@@ -231,21 +253,27 @@ class MapnikSource(MapLayer):
 
         m = self.map_obj(mapfile)
         m.resize(query.size[0], query.size[1])
-        m.srs = '+init=%s' % str(query.srs.srs_code.lower())
+        srs = '+init=%s' % str(query.srs.srs_code.lower())
+        # only set the SRS if it changed, mapnik parses it on each assignment
+        if m.srs != srs:
+            m.srs = srs
         envelope = mapnik.Box2d(*query.bbox)
         m.zoom_to_box(envelope)
         data = None
 
         try:
-            if self.layers:
+            # map objects are cached, only filter the layers if this
+            # map was not already filtered for the same set of layers
+            if self.layers and getattr(m, 'map_obj_layers', None) != self.layers:
                 i = 0
                 for layer in m.layers[:]:
                     if layer.name != 'Unknown' and layer.name not in self.layers:
                         del m.layers[i]
                     else:
                         i += 1
+                m.map_obj_layers = self.layers
 
-            img = mapnik.Image(query.size[0], query.size[1])
+            img = _render_image(query.size[0], query.size[1])
             if self.scale_factor:
                 mapnik.render(m, img, self.scale_factor)
             else:
@@ -151,6 +151,14 @@ class TestKML(SysTest):
         resp = app.get("/kml/wms_cache/0/0/0.kml", headers={"If-None-Match": etag})
         assert resp.status == "304 Not Modified"
 
+    def test_get_kml_other_host(self, app):
+        resp = app.get("/kml/wms_cache/0/0/0.kml")
+        assert "http://localhost/kml/wms_cache/EPSG900913/1/0/1.kml" in resp
+        # rendered KML documents are cached, but not across script URLs
+        resp = app.get("/kml/wms_cache/0/0/0.kml", extra_environ={"HTTP_HOST": "example.org"})
+        assert "http://localhost/" not in resp
+        assert "http://example.org/kml/wms_cache/EPSG900913/1/0/1.kml" in resp
+
     def test_get_kml_init(self, app):
         resp = app.get("/kml/wms_cache")
         xml = resp.lxml
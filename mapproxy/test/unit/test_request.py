@@ -33,6 +33,7 @@ from mapproxy.request.wms import (
     WMS111FeatureInfoRequest,
 )
 from mapproxy.request.arcgis import ArcGISRequest, ArcGISIdentifyRequest
+from mapproxy.service.kml import KMLRequest, kml_request
 from mapproxy.exception import RequestError
 from mapproxy.request.wms.exception import (
     WMS111ExceptionHandler,
@@ -738,6 +739,34 @@ class TestTileRequest(object):
         assert tile_req.layer == "osm"
         assert tile_req.dimensions == {"_layer_spec": "EPSG4326"}
 
+    def test_kml_request(self):
+        env = {"PATH_INFO": "/kml/osm/5/2/-3.png", "QUERY_STRING": ""}
+        req = Request(env)
+        kml_req = kml_request(req)
+        assert isinstance(kml_req, KMLRequest)
+        assert kml_req.tile == (2, -3, 5)
+        assert kml_req.format == "png"
+        assert kml_req.layer == "osm"
+        assert kml_req.dimensions == {}
+        assert kml_req.request_handler_name == "map"
+
+    def test_kml_request_w_epsg(self):
+        env = {"PATH_INFO": "/kml/osm/EPSG4326/5/2/3.kml", "QUERY_STRING": ""}
+        req = Request(env)
+        kml_req = kml_request(req)
+        assert isinstance(kml_req, KMLRequest)
+        assert kml_req.tile == (2, 3, 5)
+        assert kml_req.format == "kml"
+        assert kml_req.layer == "osm"
+        assert kml_req.dimensions == {"_layer_spec": "EPSG4326"}
+        assert kml_req.request_handler_name == "kml"
+
+    def test_invalid_kml_request(self):
+        env = {"PATH_INFO": "/kml/osm/5/2.png", "QUERY_STRING": ""}
+        req = Request(env)
+        with pytest.raises(RequestError):
+            kml_request(req)
+
 
 def test_request_params_pickle():
     params = RequestParams(dict(foo="bar", zing="zong"))